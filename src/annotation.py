@@ -15,11 +15,11 @@ from PyQt6.QtGui import QImage, QPixmap, QPainter, QPen, QColor
 
 from datetime import datetime
 # from acc_types import Acceleration
-from models import Acceleration
+from models import Acceleration, AccelerationSeries, FallState
 
 """Annotate Acceleration Data From Accelerometer And Save data as CSV file"""
 
-DATA_POINTS = []
+DATA_POINTS = AccelerationSeries()
 
 
 class AnnotateAccelerometerData(QMainWindow):
@@ -28,7 +28,7 @@ class AnnotateAccelerometerData(QMainWindow):
 
         self.setWindowTitle("Annotate Accelerometer Data")
         self.setGeometry(100, 100, 500, 300)
-        self.fall_state = "0"
+        self.fall_state = FallState.DEFAULT
 
         central_widget = QWidget(self)
         self.setCentralWidget(central_widget)
@@ -60,21 +60,14 @@ class AnnotateAccelerometerData(QMainWindow):
         layout.addWidget(save_button)
 
     def fall_button_clicked(self):
-        self.fall_state = "Start"
-        print("Fall", self.fall_state)
+        self.fall_state = FallState.START
+        print("Fall", self.fall_state.name)
 
     def not_fall_button_clicked(self):
-        self.fall_state = "Stop"
-        print("Not Fall", self.fall_state)
+        self.fall_state = FallState.STOP
+        print("Not Fall", self.fall_state.name)
 
     def on_data_received(self, acceleration: Acceleration):
-        print(acceleration)
-        if self.fall_state == "Start":
-            acceleration.fall_state = "1"
-        elif self.fall_state == "Stop":
-            acceleration.fall_state = "0"
-        else:
-            acceleration.fall_state = "0"
         DATA_POINTS.append(acceleration)
 
     def save_as_csv(self):
@@ -82,9 +75,7 @@ class AnnotateAccelerometerData(QMainWindow):
             writer = csv.writer(file)
             head = ["timestamp", "timestamp_local", "ax", "ay", "az", "fall_state"]
             writer.writerow(head)
-
-            for field in DATA_POINTS:
-                writer.writerow(field.as_csv_field())
+            writer.writerows(DATA_POINTS.as_csv_rows())
         DATA_POINTS.clear()
 
 
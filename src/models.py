@@ -1,21 +1,99 @@
+import array
 import dataclasses
+import enum
+import time
+from datetime import datetime, timedelta
 
+# Samples are stamped with the monotonic clock, which is cheap to read, and are
+# only turned into wall-clock datetimes relative to this anchor when written out.
+_WALL_ANCHOR = datetime.now()
+_MONOTONIC_ANCHOR_NS = time.monotonic_ns()
+# Added to a monotonic reading gives local wall-clock nanoseconds since
+# 1970-01-01, for converting whole columns at once
+_WALL_ANCHOR_US = (_WALL_ANCHOR - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+LOCAL_TIME_OFFSET_NS = _WALL_ANCHOR_US * 1000 - _MONOTONIC_ANCHOR_NS
 
-@dataclasses.dataclass
+
+def local_time(monotonic_ns: int) -> datetime:
+    """Convert a time.monotonic_ns() reading into local wall-clock time."""
+    return _WALL_ANCHOR + timedelta(
+        microseconds=(monotonic_ns - _MONOTONIC_ANCHOR_NS) // 1000
+    )
+
+
+class FallState(enum.IntEnum):
+    DEFAULT = 0
+    START = 1
+    STOP = 2
+
+
+# Fall label written out for each FallState: 1 while a fall is in progress
+FALL_LABELS = (0, 1, 0)
+
+
+@dataclasses.dataclass(slots=True)
 class Acceleration:
     timestamp: int
-    timestamp_local: str
+    timestamp_local_ns: int
     ax: float
     ay: float
     az: float
-    fall_state: str
+    fall_state: int
 
     def as_csv_field(self):
-        return [
+        return (
+            self.timestamp,
+            str(local_time(self.timestamp_local_ns)),
+            self.ax,
+            self.ay,
+            self.az,
+            FALL_LABELS[self.fall_state],
+        )
+
+
+class AccelerationSeries:
+    """Column-oriented store for a session of Acceleration samples.
+
+    Keeps one compact array per field instead of one object per sample, so
+    long recordings stay small in memory and can be written out column-wise.
+    """
+
+    def __init__(self):
+        self.timestamp = array.array("I")
+        self.timestamp_local_ns = array.array("q")
+        self.ax = array.array("f")
+        self.ay = array.array("f")
+        self.az = array.array("f")
+        self.fall_state = array.array("B")
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def append(self, acceleration: Acceleration):
+        self.timestamp.append(acceleration.timestamp)
+        self.timestamp_local_ns.append(acceleration.timestamp_local_ns)
+        self.ax.append(acceleration.ax)
+        self.ay.append(acceleration.ay)
+        self.az.append(acceleration.az)
+        self.fall_state.append(acceleration.fall_state)
+
+    def as_csv_rows(self):
+        return zip(
+            self.timestamp,
+            map(str, map(local_time, self.timestamp_local_ns)),
+            self.ax,
+            self.ay,
+            self.az,
+            map(FALL_LABELS.__getitem__, self.fall_state),
+        )
+
+    def clear(self):
+        for column in (
             self.timestamp,
-            self.timestamp_local,
+            self.timestamp_local_ns,
             self.ax,
             self.ay,
             self.az,
             self.fall_state,
-        ]
+        ):
+            del column[:]
@@ -3,8 +3,8 @@
 The script will configure the native BLE sensor in central configuration and scan for
 the sensor ending with given SENSOR_ID. Once a new sensor is found then initiates the
 connection, set the command characteristics values and enable notification service.
-All the binary data packet will be parsed and sensor payload objects will be stored
-locally and save into a csv file on the  ctrl+c exit signal.
+All the binary data packet will be parsed and sensor payload objects will be streamed
+into a csv (or, with ``--format parquet``, a parquet) file until the window is closed.
 
 Install Bleak before running the script by
 
@@ -23,86 +23,37 @@ Usage:
 """
 
 import asyncio
-import csv
+import json
 import logging
 import signal
 import struct
 import sys
-import threading
-from functools import reduce
-from datetime import datetime
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Callable, Optional
 
-from bleak import BleakClient
+import qasync
+from bleak import BleakClient, BleakScanner
 from bleak import _logger as logger
-from bleak import discover
-from PyQt6.QtCore import QObject, QThread, pyqtSignal
+from bleak.exc import BleakError
 from PyQt6.QtWidgets import QApplication
 
-from models import Acceleration
+from models import Acceleration, FallState
 from annotation import AnnotateAccelerometerData
-# from src.binary_parser import DataView
+from storage import OUTPUT_FORMATS, SampleWriterThread
 
 SENSOR_ID = "223430000278"
 WRITE_CHARACTERISTIC_UUID = "34800001-7185-4d5d-b431-630e7050e8f0"
 NOTIFY_CHARACTERISTIC_UUID = "34800002-7185-4d5d-b431-630e7050e8f0"
-DATA_POINTS = []
-
-
-class DataView:
-    def __init__(self, array, bytes_per_element=1):
-        """
-        bytes_per_element is the size of each element in bytes.
-        By default, we assume the array is one byte per element.
-        """
-        self.array = array
-        self.bytes_per_element = 1
-
-    def __get_binary(self, start_index, byte_count, signed=False):
-        integers = [self.array[start_index + x] for x in range(byte_count)]
-        bytes = [
-            integer.to_bytes(self.bytes_per_element, byteorder="little", signed=signed)
-            for integer in integers
-        ]
-        return reduce(lambda a, b: a + b, bytes)
-
-    def get_uint_16(self, start_index):
-        bytes_to_read = 2
-        return int.from_bytes(
-            self.__get_binary(start_index, bytes_to_read), byteorder="little"
-        )
-
-    def get_uint_8(self, start_index):
-        bytes_to_read = 1
-        return int.from_bytes(
-            self.__get_binary(start_index, bytes_to_read), byteorder="little"
-        )
+ADDRESS_CACHE_PATH = Path.home() / ".cache" / "movesensor.json"
+SCAN_TIMEOUT = 10.0
+# Samples waiting for the consumer; beyond this new samples are dropped
+MAX_QUEUED_SAMPLES = 4096
 
-    def get_uint_32(self, start_index):
-        bytes_to_read = 4
-        binary = self.__get_binary(start_index, bytes_to_read)
-        return struct.unpack("<I", binary)[0]  # <f for little endian
-
-    def get_float_32(self, start_index):
-        bytes_to_read = 4
-        binary = self.__get_binary(start_index, bytes_to_read)
-        return struct.unpack("<f", binary)[0]  # <f for little endian
-
-    def get_int_32(self, start_index):
-        bytes_to_read = 4
-        binary = self.__get_binary(start_index, bytes_to_read)
-        return struct.unpack("<i", binary)[0]  # <f for little endian
-
-    def get_int_arr(self):
-        byte_length = len(self.array)
-        result = []
-        start_index = 6
-        bytes_to_read = 4
-        number_of_readings = 16
-        for index in [
-            start_index + bytes_to_read * i for i in range(number_of_readings)
-        ]:
-            result.append(self.get_int_32(index))
-        return result
+# Notification payload: 2 header bytes, u32 sensor timestamp, f32 ax, ay, az
+_PACKET = struct.Struct("<xxIfff")
+_monotonic_ns = time.monotonic_ns
 
 
 # @dataclasses.dataclass
@@ -118,80 +69,178 @@ class DataView:
 #         return [self.timestamp, self.timestamp_local, self.ax, self.ay, self.az, self.fall_state]
 
 
-def save_as_csv():
-    with open(f"sensor_data_{datetime.now()}.csv", "w", newline="") as file:
-        writer = csv.writer(file)
-        head = ["timestamp", "timestamp_local", "ax", "ay", "az", "fall_state"]
-        writer.writerow(head)
-
-        for field in DATA_POINTS:
-            writer.writerow(field.as_csv_field())
-
-
-async def run_queue_consumer(queue: asyncio.Queue, stop_signal: pyqtSignal):
+async def run_queue_consumer(queue: asyncio.Queue, writer: SampleWriterThread):
     while True:
-        data = await queue.get()
-        if data is None or thread_instance.stop_event.is_set:
-            save_as_csv()
+        # One wake-up drains everything that queued up while we waited
+        batch = [await queue.get()]
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+
+        done = None in batch
+        if done:
+            batch = batch[: batch.index(None)]
+        if batch and not writer.put(batch):
+            if writer.dropped_samples == len(batch):
+                logger.warning("Disk writes are falling behind, dropping samples")
+
+        if done:
             logger.info(
                 "Got message from client about disconnection. Exiting consumer loop..."
             )
             break
-        else:
-            # print(data)
-            DATA_POINTS.append(data)
+
+
+def load_address_cache() -> dict:
+    """Return the {serial: address} map of sensors we connected to before."""
+    try:
+        with open(ADDRESS_CACHE_PATH) as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    # A hand-edited or corrupt file is treated like a missing one
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_address_cache(cache: dict):
+    ADDRESS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(ADDRESS_CACHE_PATH, "w") as file:
+        json.dump(cache, file)
+
+
+async def discover_address(end_of_serial: str) -> Optional[str]:
+    """Scan until the sensor advertises, or give up after SCAN_TIMEOUT seconds."""
+
+    def is_sensor(d, adv=None):
+        return (name := d.name) is not None and name.endswith(end_of_serial)
+
+    if hasattr(BleakScanner, "find_device_by_filter"):
+        device = await BleakScanner.find_device_by_filter(
+            is_sensor, timeout=SCAN_TIMEOUT
+        )
+    else:
+        # Older bleak releases can only hand back the complete scan result
+        devices = await BleakScanner.discover(timeout=SCAN_TIMEOUT)
+        device = next((d for d in devices if is_sensor(d)), None)
+    if device is None:
+        return None
+    logger.info("device found: %s", device)
+    return device.address
+
+
+async def connect_sensor(
+    end_of_serial: str, disconnected_callback
+) -> Optional[BleakClient]:
+    """Connect to the sensor, trying its cached address before scanning.
+
+    A successful connect after a scan records the address, so the next run
+    can skip discovery; a cached address that no longer connects is dropped.
+    """
+    cache = load_address_cache()
+    address = cache.get(end_of_serial)
+    if address is not None:
+        client = BleakClient(address, disconnected_callback=disconnected_callback)
+        try:
+            await client.connect()
+            logger.info("Connected to cached address %s", address)
+            return client
+        except (BleakError, asyncio.TimeoutError):
+            logger.info("Cached address %s not reachable, scanning", address)
+            del cache[end_of_serial]
+            try:
+                save_address_cache(cache)
+            except OSError as e:
+                logger.warning("Could not update the address cache: %s", e)
+
+    address = await discover_address(end_of_serial)
+    if address is None:
+        return None
+    client = BleakClient(address, disconnected_callback=disconnected_callback)
+    try:
+        await client.connect()
+    except (BleakError, asyncio.TimeoutError) as e:
+        logger.warning("Could not connect to %s: %s", address, e)
+        return None
+    cache[end_of_serial] = address
+    try:
+        save_address_cache(cache)
+    except OSError as e:
+        # The session works without the cache; only the next scan is slower
+        logger.warning("Could not update the address cache: %s", e)
+    return client
+
+
+async def negotiate_link(client: BleakClient):
+    """Make sure the connection uses the largest ATT MTU the OS will give us.
+
+    Most backends exchange the MTU while connecting, but BlueZ only does so
+    once a characteristic is acquired, and reports 23 bytes until then. A
+    larger MTU leaves room for the higher rate streams (/Meas/Acc/104,
+    /Meas/ECG/125) to fit more samples per notification.
+
+    bleak does not expose the connection interval or the PHY; those stay with
+    the OS defaults. A shorter interval and 2M PHY raise throughput further but
+    cost the sensor battery, which the 13 Hz stream does not need.
+    """
+    if client._backend.__class__.__name__ == "BleakClientBlueZDBus":
+        try:
+            await client._backend._acquire_mtu()
+        except Exception as e:
+            # Best effort: the session works with the default MTU
+            logger.warning("Could not acquire MTU: %s", e)
+    logger.info("ATT MTU: %d", client.mtu_size)
 
 
 async def run_ble_client(
-    end_of_serial: str, queue: asyncio.Queue, data_received_signal: pyqtSignal
+    end_of_serial: str,
+    queue: asyncio.Queue,
+    on_data_received: Optional[Callable[[Acceleration], None]],
+    disconnected_event: asyncio.Event,
+    fall_state: Callable[[], int] = lambda: FallState.DEFAULT,
 ):
-    # Check the device is available
-    devices = await discover()
-    found = False
-    address = None
-    for d in devices:
-        print("device:", d)
-        if d.name and d.name.endswith(end_of_serial):
-            print("device found")
-            address = d.address
-            found = True
-            break
-
-    # This event is set if device disconnects or ctrl+c is pressed
-    disconnected_event = asyncio.Event()
+    # disconnected_event is set if the device disconnects or the window is closed
+    # fall_state returns the annotation to stamp on each incoming sample
 
     # def raise_graceful_exit(*args):
     #     disconnected_event.set()
 
+    dropped_samples = 0
+
     def disconnect_callback(client):
         logger.info("Disconnected callback called!")
         disconnected_event.set()
 
-    async def notification_handler(sender, data):
-        """Simple notification handler which prints the data received."""
-        d = DataView(data)
+    def notification_handler(sender, data):
+        """Parse a sensor packet and queue it for the consumer."""
+        nonlocal dropped_samples
         # Dig data from the binary
-        msg = "Data: ts: {}, ax: {}, ay: {}, az: {}".format(
-            d.get_uint_32(2), d.get_float_32(6), d.get_float_32(10), d.get_float_32(14)
-        )
-        # print(msg)
+        ts, ax, ay, az = _PACKET.unpack_from(data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("ts=%s ax=%s ay=%s az=%s", ts, ax, ay, az)
 
         acc_data = Acceleration(
-            timestamp=d.get_uint_32(2),
-            timestamp_local=(str(datetime.now())),
-            ax=d.get_float_32(6),
-            ay=d.get_float_32(10),
-            az=d.get_float_32(14),
-            fall_state=annotation.fall_state,
+            timestamp=ts,
+            timestamp_local_ns=_monotonic_ns(),
+            ax=ax,
+            ay=ay,
+            az=az,
+            fall_state=fall_state(),
         )
-        data_received_signal.emit(acc_data)
+        if on_data_received is not None:
+            on_data_received(acc_data)
         # queue message for later consumption
-        await queue.put(acc_data)
+        try:
+            queue.put_nowait(acc_data)
+        except asyncio.QueueFull:
+            dropped_samples += 1
+            if dropped_samples == 1:
+                logger.warning("Consumer is falling behind, dropping samples")
 
-    if found:
-        async with BleakClient(
-            address, disconnected_callback=disconnect_callback
-        ) as client:
+    # Check the device is available
+    client = await connect_sensor(end_of_serial, disconnect_callback)
+
+    if client is not None:
+        try:
+            await negotiate_link(client)
             loop = asyncio.get_event_loop()
             # Add signal handler for ctrl+c
             # signal.signal(signal.SIGINT, raise_graceful_exit)
@@ -234,80 +283,101 @@ async def run_ble_client(
             await queue.put(None)
 
             await asyncio.sleep(1.0)
+        finally:
+            # Reported here so sessions ending in an error or cancel count too
+            if dropped_samples:
+                logger.warning("Dropped %d samples", dropped_samples)
+            await client.disconnect()
 
     else:
         # Signal consumer to exit
         await queue.put(None)
         print("Sensor  ******" + end_of_serial, "not found!")
 
+    return dropped_samples
+
 
-# async def main(end_of_serial: str, data_received_signal: pyqtSignal):
-#     queue = asyncio.Queue()
-#     client_task = run_ble_client(end_of_serial, queue, data_received_signal)
-#     consumer_task = run_queue_consumer(queue)
-#     await asyncio.gather(client_task, consumer_task)
-#     logger.info("Main method done!")
-    
 async def main(
-    end_of_serial: str, data_received_signal: pyqtSignal, stop_signal: pyqtSignal
-):
-    queue = asyncio.Queue()
-    client_task = run_ble_client(end_of_serial, queue, data_received_signal)
-    consumer_task = run_queue_consumer(queue, stop_signal)
-    await asyncio.gather(client_task, consumer_task)
+    end_of_serial: str,
+    on_data_received: Optional[Callable[[Acceleration], None]],
+    stop_event: asyncio.Event,
+    writer: SampleWriterThread,
+    fall_state: Callable[[], int] = lambda: FallState.DEFAULT,
+) -> int:
+    """Run one BLE session and return the number of samples dropped.
+
+    Samples are dropped when the queue to the consumer is full, or when the
+    writer thread has too many samples waiting for the disk.
+    """
+    queue = asyncio.Queue(maxsize=MAX_QUEUED_SAMPLES)
+    writer.start()
+    consumer_task = asyncio.ensure_future(run_queue_consumer(queue, writer))
+    # A consumer that stops early (e.g. the writer failed) ends the BLE session
+    consumer_task.add_done_callback(lambda task: stop_event.set())
+    try:
+        dropped_samples = await run_ble_client(
+            end_of_serial, queue, on_data_received, stop_event, fall_state
+        )
+        await consumer_task
+    finally:
+        # If the client failed it never sent the sentinel the consumer waits for
+        consumer_task.cancel()
+        try:
+            # Hand over what the client queued before it stopped
+            batch = []
+            while not queue.empty() and (data := queue.get_nowait()) is not None:
+                batch.append(data)
+            if batch and writer.is_alive():
+                writer.put(batch)
+        finally:
+            # The writer thread is not a daemon; it must be closed on every path
+            writer.close()
+            await asyncio.to_thread(writer.join)
+            if writer.dropped_samples:
+                logger.warning("Writer dropped %d samples", writer.dropped_samples)
+    writer.check()
     logger.info("Main method done!")
-
-
-# def run_asyncio_loop(end_of_serial: str):
-#     asyncio.run(main(end_of_serial=end_of_serial))
-class ThreadManager(QObject):
-    data_received = pyqtSignal(Acceleration)
-    stop_signal = pyqtSignal()
-
-    def __init__(self):
-        super().__init__()
-        self.thread = QThread()
-        self.stop_event = asyncio.Event()
-        self.moveToThread(self.thread)
-        self.thread.started.connect(self.run_asyncio_loop)
-        self.stop_signal.connect(self.set_stop_event)
-        self.thread.start()
-
-    def run_asyncio_loop(self):
-        asyncio.run(main(SENSOR_ID, self.data_received, self.stop_signal))
-
-    def set_stop_event(self):
-        self.stop_event.set()
-        asyncio.run(main(SENSOR_ID, self.data_received, self.stop_signal))
-
-    def stop(self):
-        self.stop_signal.emit()
-        self.thread.quit()
-        self.thread.wait()
-
-    def __del__(self):
-        self.stop()
-
-
-# def run_asyncio_loop(end_of_serial: str):
-#     asyncio.run(main(end_of_serial=end_of_serial))
+    return dropped_samples + writer.dropped_samples
 
 
 if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv")
+    args = parser.parse_args()
+    # Open the session file up front so a bad format or path fails before BLE starts
+    writer = SampleWriterThread(args.format)
+
+    logging.basicConfig(level=logging.INFO)
     app = QApplication(sys.argv)
 
-    thread_instance = ThreadManager()
+    # Run asyncio on the Qt event loop so BLE callbacks reach the GUI
+    # directly instead of through a worker thread and queued signals.
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
 
     annotation = AnnotateAccelerometerData()
-
-    thread_instance.data_received.connect(annotation.on_data_received)
-
     annotation.show()
-    logging.basicConfig(level=logging.INFO)
-    # asyncio.run(main(SENSOR_ID, thread_instance.data_received))
-
-    app.aboutToQuit.connect(thread_instance.stop)
-    app.exec()
 
-    # threading.Thread(target=run_asyncio_loop, args=(SENSOR_ID,), daemon=True).start()
-    # sys.exit(app.exec())
+    # Closing the window ends the BLE session and then the application
+    stop_event = asyncio.Event()
+    window_closed = asyncio.Event()
+    app.setQuitOnLastWindowClosed(False)
+    app.lastWindowClosed.connect(stop_event.set)
+    app.lastWindowClosed.connect(window_closed.set)
+
+    with loop:
+        try:
+            loop.run_until_complete(
+                main(
+                    SENSOR_ID,
+                    annotation.on_data_received,
+                    stop_event,
+                    writer,
+                    lambda: annotation.fall_state,
+                )
+            )
+        except Exception:
+            logger.exception("BLE session failed")
+        # Keep the window up after the sensor is lost, not found or the session
+        # failed, so the annotated samples can still be saved
+        loop.run_until_complete(window_closed.wait())
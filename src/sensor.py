@@ -16,6 +16,11 @@ from bleak import _logger as logger
 from bleak import discover
 from datetime import datetime
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 SENSOR_ID = "223430000278"
 WRITE_CHARACTERISTIC_UUID = "34800001-7185-4d5d-b431-630e7050e8f0"
 NOTIFY_CHARACTERISTIC_UUID = "34800002-7185-4d5d-b431-630e7050e8f0"
@@ -122,15 +127,15 @@ async def run_queue_consumer(queue: asyncio.Queue):
 async def run_ble_client(end_of_serial: str, queue: asyncio.Queue):
     # Check the device is available
     devices = await discover()
-    found = False
+    device = next(
+        (d for d in devices if (name := d.name) and name.endswith(end_of_serial)),
+        None,
+    )
+    found = device is not None
     address = None
-    for d in devices:
-        print("device:", d)
-        if d.name and d.name.endswith(end_of_serial):
-            print("device found")
-            address = d.address
-            found = True
-            break
+    if found:
+        logger.info("device found: %s", device)
+        address = device.address
 
     # This event is set if device disconnects or ctrl+c is pressed
     disconnected_event = asyncio.Event()
@@ -225,4 +230,6 @@ async def main(end_of_serial: str):
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
+    if uvloop is not None:
+        uvloop.install()
     asyncio.run(main(SENSOR_ID))
@@ -0,0 +1,183 @@
+"""Session file writers for streamed Acceleration samples.
+
+Both writers take batches of samples as they come off the BLE queue, so a
+recording never has to be held in memory as a whole. SampleWriterThread runs
+a writer on its own thread so slow disk writes never stall the asyncio loop.
+"""
+
+import csv
+import io
+import queue
+import threading
+from datetime import datetime
+
+from models import FALL_LABELS, LOCAL_TIME_OFFSET_NS, AccelerationSeries
+
+HEADER = ["timestamp", "timestamp_local", "ax", "ay", "az", "fall_state"]
+CSV_BUFFER_SIZE = 1 << 20
+PARQUET_ROW_GROUP_SIZE = 1 << 16
+# Samples handed to SampleWriterThread but not yet written; beyond this new
+# batches are dropped so a stalled disk cannot grow memory without bound
+WRITER_MAX_PENDING_SAMPLES = 1 << 12
+OUTPUT_FORMATS = ("csv", "parquet")
+
+
+class CsvSampleWriter:
+    """Formats rows into memory and writes them to the file in large chunks.
+
+    The file is opened unbuffered so each chunk of about CSV_BUFFER_SIZE
+    bytes reaches the OS in a single write call.
+    """
+
+    def __init__(self, path, buffer_size=CSV_BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._file = open(path, "wb", buffering=0)
+        self._buffer = io.StringIO(newline="")
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(HEADER)
+
+    def write(self, samples):
+        self._writer.writerows(sample.as_csv_field() for sample in samples)
+        if self._buffer.tell() >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        data = memoryview(self._buffer.getvalue().encode("utf-8"))
+        # Unbuffered writes may be partial
+        while data:
+            data = data[self._file.write(data) :]
+        self._buffer.seek(0)
+        self._buffer.truncate(0)
+
+    def close(self):
+        try:
+            self._flush()
+        finally:
+            self._file.close()
+
+
+class ParquetSampleWriter:
+    """Collects samples column-wise and writes them as zstd Parquet row groups."""
+
+    def __init__(self, path, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.row_group_size = row_group_size
+        self._pa = pa
+        self._pc = pc
+        self._fall_labels = pa.array(FALL_LABELS, pa.uint8())
+        self._schema = pa.schema(
+            [
+                ("timestamp", pa.uint32()),
+                ("timestamp_local", pa.timestamp("us")),
+                ("ax", pa.float32()),
+                ("ay", pa.float32()),
+                ("az", pa.float32()),
+                ("fall_state", pa.uint8()),
+            ]
+        )
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+        self._series = AccelerationSeries()
+
+    def write(self, samples):
+        for sample in samples:
+            self._series.append(sample)
+        if len(self._series) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        pa, pc = self._pa, self._pc
+        series = self._series
+        # Same conversion as local_time(), done on the whole column
+        local_ns = pc.add(
+            pa.array(series.timestamp_local_ns, pa.int64()), LOCAL_TIME_OFFSET_NS
+        )
+        table = pa.Table.from_arrays(
+            [
+                series.timestamp,
+                pc.divide(local_ns, 1000).cast(pa.timestamp("us")),
+                series.ax,
+                series.ay,
+                series.az,
+                self._fall_labels.take(pa.array(series.fall_state, pa.uint8())),
+            ],
+            schema=self._schema,
+        )
+        self._writer.write_table(table)
+        series.clear()
+
+    def close(self):
+        if len(self._series):
+            self._flush()
+        self._writer.close()
+
+
+def open_sample_writer(output_format="csv"):
+    """Open a writer for a new session file in the given output format."""
+    if output_format == "csv":
+        return CsvSampleWriter(f"sensor_data_{datetime.now()}.csv")
+    if output_format == "parquet":
+        return ParquetSampleWriter(f"sensor_data_{datetime.now()}.parquet")
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+class SampleWriterThread(threading.Thread):
+    """Writes sample batches handed over by put() on a dedicated thread.
+
+    At most max_pending_samples samples wait for the disk; put() drops batches
+    beyond that and counts them in dropped_samples. If writing fails the thread
+    closes the file and stops; the error is kept and raised from the next put()
+    and from check().
+    """
+
+    def __init__(
+        self, output_format="csv", max_pending_samples=WRITER_MAX_PENDING_SAMPLES
+    ):
+        super().__init__(name="sample-writer")
+        # Opened here so a bad path or format fails in the caller, not the thread
+        self._writer = open_sample_writer(output_format)
+        self._batches = queue.Queue()
+        self._pending_lock = threading.Lock()
+        self.max_pending_samples = max_pending_samples
+        self.pending_samples = 0
+        self.dropped_samples = 0
+        self.error = None
+
+    def check(self):
+        """Raise the error that stopped the thread, if any."""
+        if self.error is not None:
+            raise self.error
+
+    def put(self, batch):
+        """Queue a batch for writing; returns False if it was dropped instead."""
+        self.check()
+        with self._pending_lock:
+            if self.pending_samples + len(batch) > self.max_pending_samples:
+                self.dropped_samples += len(batch)
+                return False
+            self.pending_samples += len(batch)
+        self._batches.put_nowait(batch)
+        return True
+
+    def close(self):
+        """Ask the thread to write what is queued, close the file and exit."""
+        self._batches.put_nowait(None)
+
+    def run(self):
+        try:
+            while (batch := self._batches.get()) is not None:
+                self._writer.write(batch)
+                with self._pending_lock:
+                    self.pending_samples -= len(batch)
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self._writer.close()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
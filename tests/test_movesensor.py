@@ -0,0 +1,246 @@
+"""Run python -m unittest tests/test_movesensor.py in the terminal to run the tests"""
+
+import asyncio
+import glob
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# The src modules import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+from models import Acceleration, FallState
+from storage import HEADER, SampleWriterThread
+
+try:
+    import movesensor
+    from bleak.exc import BleakError
+except ImportError:
+    movesensor = None
+
+
+@unittest.skipIf(movesensor is None, "bleak, qasync or PyQt6 is not installed")
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def run_main(self, run_ble_client, writer=None):
+        writer = writer or SampleWriterThread("csv")
+        loop = asyncio.new_event_loop()
+        try:
+            with mock.patch.object(movesensor, "run_ble_client", run_ble_client):
+                return loop.run_until_complete(
+                    movesensor.main(movesensor.SENSOR_ID, None, asyncio.Event(), writer)
+                )
+        finally:
+            loop.close()
+            writer.join(timeout=5)
+            self.assertFalse(writer.is_alive())
+
+    def read_session(self):
+        (path,) = glob.glob("sensor_data_*.csv")
+        with open(path, newline="") as file:
+            return file.read().splitlines()
+
+    def test_samples_are_written_until_the_sentinel(self):
+        async def run_ble_client(
+            end_of_serial, queue, on_data_received, stop_event, fall_state
+        ):
+            for i in range(3):
+                await queue.put(Acceleration(i, time.monotonic_ns(), 1.0, 2.0, 3.0, 0))
+            await queue.put(None)
+            return 0
+
+        self.assertEqual(self.run_main(run_ble_client), 0)
+
+        lines = self.read_session()
+        self.assertEqual(lines[0], ",".join(HEADER))
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["0", "1", "2"])
+
+    def test_client_error_still_stops_the_writer(self):
+        async def run_ble_client(
+            end_of_serial, queue, on_data_received, stop_event, fall_state
+        ):
+            await queue.put(Acceleration(7, time.monotonic_ns(), 1.0, 2.0, 3.0, 0))
+            raise RuntimeError("connect failed")
+
+        with self.assertRaises(RuntimeError):
+            self.run_main(run_ble_client)
+
+        lines = self.read_session()
+        self.assertEqual(lines[0], ",".join(HEADER))
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["7"])
+
+    def test_writer_error_ends_the_session_and_is_raised(self):
+        writer = SampleWriterThread("csv")
+        writer._writer.write = mock.Mock(side_effect=OSError("disk full"))
+
+        async def run_ble_client(
+            end_of_serial, queue, on_data_received, stop_event, fall_state
+        ):
+            while not stop_event.is_set():
+                await queue.put(Acceleration(1, time.monotonic_ns(), 1.0, 2.0, 3.0, 0))
+                await asyncio.sleep(0.01)
+            await queue.put(None)
+
+        with self.assertRaisesRegex(OSError, "disk full"):
+            self.run_main(run_ble_client, writer)
+
+    def test_slow_writer_drops_samples_instead_of_queueing_them(self):
+        writer = SampleWriterThread("csv", max_pending_samples=100)
+        write = writer._writer.write
+        peak_pending = 0
+
+        def slow_write(samples):
+            nonlocal peak_pending
+            peak_pending = max(peak_pending, writer.pending_samples)
+            time.sleep(0.02)
+            write(samples)
+
+        writer._writer.write = slow_write
+
+        async def run_ble_client(
+            end_of_serial, queue, on_data_received, stop_event, fall_state
+        ):
+            for i in range(5000):
+                await queue.put(Acceleration(i, time.monotonic_ns(), 1.0, 2.0, 3.0, 0))
+                if i % 10 == 0:
+                    await asyncio.sleep(0)
+            await queue.put(None)
+            return 0
+
+        dropped = self.run_main(run_ble_client, writer)
+
+        self.assertGreater(dropped, 0)
+        self.assertEqual(dropped, writer.dropped_samples)
+        self.assertLessEqual(peak_pending, 100)
+        self.assertEqual(len(self.read_session()) - 1 + dropped, 5000)
+
+
+@unittest.skipIf(movesensor is None, "bleak, qasync or PyQt6 is not installed")
+class TestRunBleClient(unittest.TestCase):
+    def run_client(self, **kwargs):
+        stop_event = asyncio.Event()
+        client = mock.Mock(is_connected=False, mtu_size=247)
+        client.write_gatt_char = mock.AsyncMock()
+        client.disconnect = mock.AsyncMock()
+
+        async def start_notify(uuid, handler):
+            # One packet: header, sensor timestamp 5, ax, ay, az
+            handler(None, movesensor._PACKET.pack(5, 1.0, 2.0, 3.0))
+            stop_event.set()
+
+        client.start_notify = start_notify
+
+        async def run():
+            queue = asyncio.Queue()
+            await movesensor.run_ble_client(
+                movesensor.SENSOR_ID, queue, None, stop_event, **kwargs
+            )
+            return [queue.get_nowait() for _ in range(queue.qsize())]
+
+        with mock.patch.object(
+            movesensor, "connect_sensor", mock.AsyncMock(return_value=client)
+        ), mock.patch.object(movesensor.asyncio, "sleep", mock.AsyncMock()):
+            return asyncio.run(run())
+
+    def test_samples_get_the_default_fall_state_without_a_source(self):
+        sample, sentinel = self.run_client()
+        self.assertEqual((sample.timestamp, sample.fall_state), (5, FallState.DEFAULT))
+        self.assertIsNone(sentinel)
+
+    def test_samples_get_the_fall_state_from_the_source(self):
+        sample, sentinel = self.run_client(fall_state=lambda: FallState.START)
+        self.assertEqual(sample.fall_state, FallState.START)
+
+
+@unittest.skipIf(movesensor is None, "bleak, qasync or PyQt6 is not installed")
+class TestConnectSensor(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(
+            movesensor,
+            "ADDRESS_CACHE_PATH",
+            Path(self.tmp.name) / "movesensor.json",
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_non_dict_cache_is_a_miss(self):
+        movesensor.ADDRESS_CACHE_PATH.write_text('["AA:BB"]')
+        self.assertEqual(movesensor.load_address_cache(), {})
+
+    def test_failed_connect_after_scan_returns_none(self):
+        client = mock.Mock()
+        client.connect = mock.AsyncMock(side_effect=BleakError("connect failed"))
+        discover_address = mock.AsyncMock(return_value="AA:BB")
+
+        with mock.patch.object(
+            movesensor, "BleakClient", return_value=client
+        ), mock.patch.object(movesensor, "discover_address", discover_address):
+            result = asyncio.run(
+                movesensor.connect_sensor(movesensor.SENSOR_ID, lambda client: None)
+            )
+
+        self.assertIsNone(result)
+        self.assertEqual(movesensor.load_address_cache(), {})
+
+    def connect(self, clients, discover_address):
+        with mock.patch.object(
+            movesensor, "BleakClient", side_effect=clients
+        ), mock.patch.object(movesensor, "discover_address", discover_address):
+            return asyncio.run(
+                movesensor.connect_sensor(movesensor.SENSOR_ID, lambda client: None)
+            )
+
+    def test_cache_hit_skips_discovery(self):
+        movesensor.save_address_cache({movesensor.SENSOR_ID: "AA:BB"})
+        client = mock.Mock()
+        client.connect = mock.AsyncMock()
+        discover_address = mock.AsyncMock()
+
+        self.assertIs(self.connect([client], discover_address), client)
+        discover_address.assert_not_called()
+
+    def test_stale_cached_address_is_removed_before_rescan(self):
+        movesensor.save_address_cache({movesensor.SENSOR_ID: "AA:BB"})
+        stale = mock.Mock()
+        stale.connect = mock.AsyncMock(side_effect=BleakError("not reachable"))
+        fresh = mock.Mock()
+        fresh.connect = mock.AsyncMock()
+        cache_during_scan = []
+
+        async def discover_address(end_of_serial):
+            cache_during_scan.append(movesensor.load_address_cache())
+            return "CC:DD"
+
+        self.assertIs(self.connect([stale, fresh], discover_address), fresh)
+        self.assertEqual(cache_during_scan, [{}])
+        self.assertEqual(
+            movesensor.load_address_cache(), {movesensor.SENSOR_ID: "CC:DD"}
+        )
+
+    def test_cache_write_failure_still_returns_the_client(self):
+        client = mock.Mock()
+        client.connect = mock.AsyncMock()
+        discover_address = mock.AsyncMock(return_value="AA:BB")
+
+        with mock.patch.object(
+            movesensor, "save_address_cache", side_effect=OSError("read-only")
+        ):
+            self.assertIs(self.connect([client], discover_address), client)
+
+
+if __name__ == "__main__":
+    unittest.main()
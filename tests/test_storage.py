@@ -0,0 +1,186 @@
+"""Run python -m unittest tests/test_storage.py in the terminal to run the tests"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+# The src modules import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+from models import Acceleration, AccelerationSeries, FallState, local_time
+from storage import HEADER, CsvSampleWriter, ParquetSampleWriter, SampleWriterThread
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def make_samples(count, fall_state=FallState.DEFAULT):
+    start = time.monotonic_ns()
+    return [
+        Acceleration(
+            timestamp=i,
+            timestamp_local_ns=start + i * 1_000_000,
+            ax=0.5 * i,
+            ay=-1.25,
+            az=9.75,
+            fall_state=fall_state.value,
+        )
+        for i in range(count)
+    ]
+
+
+class TestLocalTime(unittest.TestCase):
+    def test_offset_matches_monotonic_difference(self):
+        start = time.monotonic_ns()
+        self.assertEqual(
+            local_time(start + 1_500_000_000) - local_time(start),
+            timedelta(seconds=1.5),
+        )
+
+    def test_is_monotonic_and_close_to_wall_clock(self):
+        first = local_time(time.monotonic_ns())
+        second = local_time(time.monotonic_ns())
+        self.assertLessEqual(first, second)
+        self.assertLess(abs(datetime.now() - second), timedelta(seconds=1))
+
+
+class TestAccelerationSeries(unittest.TestCase):
+    def test_append_and_as_csv_rows(self):
+        series = AccelerationSeries()
+        samples = make_samples(2) + make_samples(1, FallState.START)
+        for sample in samples:
+            series.append(sample)
+
+        self.assertEqual(len(series), 3)
+        self.assertEqual(
+            list(series.as_csv_rows()),
+            [sample.as_csv_field() for sample in samples],
+        )
+        self.assertEqual([row[5] for row in series.as_csv_rows()], [0, 0, 1])
+
+    def test_clear(self):
+        series = AccelerationSeries()
+        for sample in make_samples(3):
+            series.append(sample)
+        series.clear()
+
+        self.assertEqual(len(series), 0)
+        self.assertEqual(list(series.as_csv_rows()), [])
+
+
+class TestCsvSampleWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "session.csv")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self):
+        with open(self.path, "rb") as file:
+            return file.read().decode("utf-8")
+
+    def test_header_rows_and_line_endings(self):
+        samples = make_samples(2, FallState.START)
+        writer = CsvSampleWriter(self.path)
+        writer.write(samples)
+        writer.close()
+
+        lines = self.read().split("\r\n")
+        self.assertEqual(lines[0], ",".join(HEADER))
+        self.assertEqual(
+            lines[1],
+            f"0,{local_time(samples[0].timestamp_local_ns)},0.0,-1.25,9.75,1",
+        )
+        self.assertEqual(lines[3], "")
+        self.assertNotIn("\n", "".join(lines))
+
+    def test_flushes_across_buffer_boundary(self):
+        writer = CsvSampleWriter(self.path, buffer_size=128)
+        writer.write(make_samples(1))
+        self.assertEqual(self.read(), "")
+
+        writer.write(make_samples(3))
+        flushed = self.read()
+        self.assertEqual(flushed.count("\r\n"), 5)
+
+        writer.write(make_samples(1))
+        writer.close()
+        self.assertTrue(self.read().startswith(flushed))
+        self.assertEqual(self.read().count("\r\n"), 6)
+
+
+class TestSampleWriterThread(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_write_error_is_raised_from_put_and_check(self):
+        writer = SampleWriterThread("csv")
+        writer._writer.write = mock.Mock(side_effect=OSError("disk full"))
+        writer.start()
+        writer.put(make_samples(1))
+        writer.join(timeout=5)
+
+        self.assertFalse(writer.is_alive())
+        with self.assertRaisesRegex(OSError, "disk full"):
+            writer.put(make_samples(1))
+        with self.assertRaisesRegex(OSError, "disk full"):
+            writer.check()
+
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class TestParquetSampleWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "session.parquet")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        samples = make_samples(4, FallState.START) + make_samples(2, FallState.STOP)
+        writer = ParquetSampleWriter(self.path, row_group_size=3)
+        writer.write(samples[:4])
+        writer.write(samples[4:])
+        writer.close()
+
+        table = pq.read_table(self.path)
+        self.assertEqual(table.schema.names, HEADER)
+        self.assertEqual(str(table.schema.field("timestamp").type), "uint32")
+        self.assertEqual(
+            str(table.schema.field("timestamp_local").type), "timestamp[us]"
+        )
+        self.assertEqual(str(table.schema.field("ax").type), "float")
+        self.assertEqual(str(table.schema.field("fall_state").type), "uint8")
+
+        # The first write crosses the limit; the short tail is written on close
+        metadata = pq.ParquetFile(self.path).metadata
+        self.assertEqual(
+            [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)],
+            [4, 2],
+        )
+
+        rows = table.to_pylist()
+        self.assertEqual([row["timestamp"] for row in rows], [0, 1, 2, 3, 0, 1])
+        self.assertEqual([row["fall_state"] for row in rows], [1] * 4 + [0] * 2)
+        self.assertEqual(rows[1]["ax"], 0.5)
+        self.assertEqual(
+            [row["timestamp_local"] for row in rows],
+            [local_time(sample.timestamp_local_ns) for sample in samples],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()